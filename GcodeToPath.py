@@ -3,32 +3,51 @@ import math
 import sys
 import numpy as np
 from dataclasses import dataclass
-from tkinter.filedialog import askopenfilenames
-from matplotlib.widgets import Slider
 from functools import partial
-from typing import Optional
-from LivePlotting import LivePlot3D
+from typing import TYPE_CHECKING, Mapping, Optional, Sequence, TextIO
 import time
+import json
 import os
 
+# GUI modules (tkinter, matplotlib, LivePlotting) are imported where they are used,
+# so headless runs from PrusaSlicer or path_worker don't pay for them
+if TYPE_CHECKING:
+    from matplotlib.widgets import Slider
+
 
 ######### <CONFIG> #########
 # GCode_filenames = "../gcode/x-triwave-150mm.gcode",
 output_folder = "../pathCSVs/"
-feedrate_override = 1000  # in mm/s
 cutoff_freq = 20  # In Hz, for second order filter
 default_folder = "../gcode"
 show_plot = False
 alloc_block_size = 5000  # size of block allocation
 timestep: float = 1.0  # time between csv frames in ms
+# "csv" for text output, "f32" for float32 binary, "i32" for int32 fixed-point binary (0.001mm resolution),
+# or "segments" for the parametric segment table (resample with path_formats.reconstruct_path)
+output_format = "csv"
+output_compression: Optional[str] = None  # None, "gzip" or "lzma". Written as independently compressed blocks
+checkpoint_interval = 0  # G-code lines between parser checkpoints, 0 to disable. Interrupted runs resume from the last one
+write_index = True  # write a G-code line/layer to output row index, for partial loads with path_formats.load_lines
+
+# "accel" follows acc_spline profiles between corner_velocity and max_velocity,
+# "linear" moves at constant velocity using each move's own F word (replaces Time Trajectories.py)
+motion_mode = "accel"
+linear_batch_size = 2000  # linear moves sampled together in one vectorized pass
 
 acceleration = 40000  # in mm/s^2
 max_velocity = 2000  # in mm/s
 corner_velocity = 300  # in mm/s
+sra_travel: Optional[float] = None  # in mm, +/- travel of the short range actuators. None to not check it
+verify_output = True  # check the path against the limits above, results are written to the sidecar
 
 ######### </CONFIG> #########
 
+output_columns = ["t(ms)", "xRef", "yRef", "z", "e", "xLRA", "yLRA", "xSRA", "ySRA"]
+
 import accel_curves # This must be down here to allow accel_curves to be run independantly (since it uses some config vars)
+import path_formats
+import path_verify
 
 class PathArray:
     """An array of points, at a constant timestep for X,Y,Z, and E axes"""
@@ -36,15 +55,15 @@ class PathArray:
     def __init__(self):
         self._steps: np.ndarray = np.zeros((1, 5))
         self._act_size = 0
-        self._add_space()
+        self._add_space(alloc_block_size)
 
     def append(self, new_steps: np.ndarray):
         """Add rows to the PathArray: new_steps is a [N,4] array of the X, Y, Z and E positions"""
         # Check that there is enough space to add new_steps
-        if (self._act_size+len(new_steps) > len(self._steps)):
-            self._add_space()
-        # Update length and append the steps
         new_size = self._act_size+len(new_steps)
+        if (new_size > len(self._steps)):
+            self._add_space(new_size)
+        # Update length and append the steps
         self._steps[self._act_size:new_size, 1:] = new_steps
         self._act_size = new_size
 
@@ -54,26 +73,29 @@ class PathArray:
     def get(self):
         return self._steps[:self._act_size]
 
-    def _add_space(self):
-        """Add additional rows to the PathArray. The time column is filled at this point as well."""
-        next_time = self._steps[-1, 0] + timestep
-        self._steps = np.vstack([self._steps, np.empty((alloc_block_size, 5))])
-        self._steps[-alloc_block_size:,
-                    0] = np.arange(next_time, next_time+timestep*alloc_block_size, timestep)
+    def _add_space(self, min_size: int):
+        """Grow the PathArray to at least min_size rows. The time column is filled at this point as well.\n
+        It grows by at least half its size (and alloc_block_size), so the copies stay linear in the total size"""
+        old_size = len(self._steps)
+        new_size = max(min_size, old_size + max(alloc_block_size, old_size//2))
+        steps = np.empty((new_size, 5))
+        steps[:old_size] = self._steps
+        steps[old_size:, 0] = np.arange(old_size, new_size)*timestep
+        self._steps = steps
 
     def trim(self):
         """Remove the blank, unfilled steps at the end of the list"""
         self._steps = self._steps[:self._act_size]
 
 
-def updater(frame: int, slider: Slider, pathArr: PathArray) -> np.ndarray:
+def updater(frame: int, slider: "Slider", pathArr: PathArray) -> np.ndarray:
     slider.valmax = pathArr.size()
     # show a range of values
     return pathArr.get()[slider.val:min(slider.val+500, pathArr.size()), 1:4]
 
 
 def main() -> int:
-    global plottedPath, feedrate_override, GCode_filenames
+    global GCode_filenames
 
     # make sure the script folder is the working dir
     os.chdir(os.path.dirname(__file__))
@@ -81,89 +103,147 @@ def main() -> int:
     Prusa_output_name_override = None
     if (len(sys.argv) > 1):
         GCode_filenames = sys.argv[1],
-        # overwrite feedrate from PrusaSlicer if it exists
-        feedrate_override = int(os.environ.get(
-            "SLIC3R_PERIMETER_SPEED") or feedrate_override)
-        Prusa_output_name_override = os.environ.get("SLIC3R_PP_OUTPUT_NAME")
+        Prusa_output_name_override = apply_slicer_env(os.environ)
 
     elif ('GCode_filenames' not in globals() or len(GCode_filenames) == 0):
+        from tkinter.filedialog import askopenfilenames
         GCode_filenames = askopenfilenames(initialdir=default_folder)
 
     for file_name in GCode_filenames:
-        # Generate paths
-
-        # Default feedrate set to 2000 mm/min for now
-        print()
-        print(file_name)
-        printer: GCode_parser = GCode_parser(2000)
-        startTime: float = time.time()
-        path = printer.parse_file(file_name)
-
-        pathArray = path.get()
-        # applying second order non-causal filter
-        x_lra = np.reshape(second_order_smooth(
-            pathArray[:, 1], cutoff_freq).T, [path.size(), 1])
-        y_lra = np.reshape(second_order_smooth(
-            pathArray[:, 2], cutoff_freq), [path.size(), 1])
-        pathArray = np.hstack([pathArray, x_lra, y_lra])
-        x_sra = (pathArray[:, 1] - pathArray[:, 5])
-        x_sra = x_sra[:, np.newaxis]
-        y_sra = (pathArray[:, 2] - pathArray[:, 6])
-        y_sra = y_sra[:, np.newaxis]
-        pathArray = np.hstack([pathArray, x_sra, y_sra])
-
-        print("Parse time:", time.time()-startTime)
-        print("Total lines:", np.size(path.size()))
-
-        # print("Not implemented:")
-        # for k, v in printer.unimplemented_cmds.items():
-        #     print(f"- {k}: {v}")
-
-    # Visualizing
-        if (show_plot):
-            LivePlot3D((200, 200, 200), partial(updater, pathArr=path))
-
-    # Write file:
-        startTime = time.time()
-        timestamp = datetime.now().strftime('Date %y-%m-%d Time %H:%M:%S')
-
-        # If triggered from PrusaSlicer, override temp filename with the destination filename
-        if (Prusa_output_name_override):
-            file_name = Prusa_output_name_override
-            print(Prusa_output_name_override)
-        out_filename = os.path.basename(file_name)
-        out_filename = output_folder + \
-            os.path.splitext(out_filename)[
-                0] + f"-{corner_velocity}mms_min-{max_velocity}mms_max"
-        np.savetxt(out_filename+".csv", pathArray,
-                   delimiter=",", fmt='%.3f', header="t(ms), xRef, yRef, z, e, xLRA, yLRA, xSRA, ySRA")
-
-        size_str = size_as_str(os.path.getsize(out_filename+".csv"))
-        print(f"saved to {out_filename}.csv")
-
-    # Create sidecar file with additional data
-        with open(out_filename+".txt", 'w') as sidecar:
-            sidecar.write(f"Main File: {out_filename}.csv\n")
-            sidecar.write(f"Main File Size: {size_str}\n")
-            sidecar.write(f"Created: {timestamp}\n")
-            sidecar.write(f"2nd Order Cutoff Freq: {cutoff_freq}Hz\n")
-            sidecar.write(f"Corner Velocity: {corner_velocity} mm/s\n")
-            sidecar.write(f"Max Velocity: {max_velocity} mm/s\n")
-            sidecar.write(f"Acceleration: {acceleration} mm/s\n")
-            sidecar.write(f"Total path points: {path.size()}\n")
-            sidecar.write(f"Timestep: {timestep}ms\n")
-            sidecar.write(f"Total Time: {timestep*path.size()/1000}s")
-        print(f"saved to {os.path.abspath(out_filename)}.txt")
-        print(f"Size:{size_str}")
-
-        print("save time:", time.time()-startTime)
+        process_file(file_name, Prusa_output_name_override)
 
     return 0
 
 
-def second_order_smooth(sequence, cutoff_freq):
-    """Cutoff Freq. in Hz"""
-    alpha = calc_smoothing(cutoff_freq, timestep*1000)  # Timestep is in ms
+def apply_slicer_env(env: Mapping[str, str]) -> Optional[str]:
+    """Reads the settings PrusaSlicer passes to post-processing scripts through the environment.
+    Returns the destination filename PrusaSlicer will save the G-code as, if any"""
+    return env.get("SLIC3R_PP_OUTPUT_NAME")
+
+
+def process_file(file_name: str, output_name: Optional[str] = None) -> None:
+    """Generate the path for one G-code file and write it, with its sidecar, to output_folder.
+    output_name replaces file_name as the base of the output filenames. Does not use any GUI modules unless show_plot is set"""
+    # Generate paths
+    # Default feedrate set to 2000 mm/min for now
+    print()
+    print(file_name)
+    # If triggered from PrusaSlicer, override temp filename with the destination filename
+    out_filename = os.path.basename(
+        output_name or file_name)
+    out_filename = output_folder + \
+        os.path.splitext(out_filename)[
+            0] + f"-{corner_velocity}mms_min-{max_velocity}mms_max"
+    checkpoint_file = out_filename+".ckpt" if checkpoint_interval > 0 else None
+
+    printer: GCode_parser = GCode_parser(
+        2000, record_segments=(output_format == "segments"))
+    startTime: float = time.time()
+    path = printer.parse_file(file_name, checkpoint_file)
+
+    # The segment table is stored unfiltered, the actuator columns are added after reconstruction
+    if (output_format != "segments"):
+        pathArray = add_actuator_columns(path.get(), timestep)
+
+    print("Parse time:", time.time()-startTime)
+    print("Total lines:", np.size(path.size()))
+
+    # The segment table has no actuator columns to verify
+    verify_report = None
+    if (verify_output and output_format != "segments"):
+        startTime = time.time()
+        verify_report = path_verify.format_report(path_verify.verify_path(
+            pathArray, timestep, max_velocity, acceleration, sra_travel), timestep)
+        print(verify_report.splitlines()[-1])
+        print("Verify time:", time.time()-startTime)
+
+    # print("Not implemented:")
+    # for k, v in printer.unimplemented_cmds.items():
+    #     print(f"- {k}: {v}")
+
+# Visualizing
+    if (show_plot):
+        from LivePlotting import LivePlot3D
+        LivePlot3D((200, 200, 200), partial(updater, pathArr=path))
+
+# Write file:
+    startTime = time.time()
+    timestamp = datetime.now().strftime('Date %y-%m-%d Time %H:%M:%S')
+
+    if (output_name):
+        print(output_name)
+    csv_offsets = None
+    if (output_format == "segments"):
+        main_filename = out_filename+".seg"
+        path_formats.write_segments(
+            main_filename, printer.segment_table(), timestep, acceleration, max_velocity, motion_mode)
+    elif (output_compression):
+        main_filename = out_filename + (".csv" if output_format == "csv" else ".bin") + \
+            path_formats.compressed_extension(output_compression)
+        path_formats.write_compressed(
+            main_filename, pathArray, output_columns, timestep, output_format, output_compression)
+    elif (output_format == "csv"):
+        main_filename = out_filename+".csv"
+        csv_offsets = path_formats.write_csv(main_filename, pathArray, output_columns)
+    else:
+        main_filename = out_filename+".bin"
+        path_formats.write_binary(
+            main_filename, pathArray, output_columns, timestep, output_format)
+
+    size_str = size_as_str(os.path.getsize(main_filename))
+    print(f"saved to {main_filename}")
+    if (write_index):
+        index_filename = out_filename+".idx.npz"
+        path_formats.write_index(
+            index_filename, printer.source_index(), timestep, path.size(), csv_offsets)
+        print(f"saved to {index_filename}")
+
+# Create sidecar file with additional data
+    with open(out_filename+".txt", 'w') as sidecar:
+        sidecar.write(f"Main File: {main_filename}\n")
+        sidecar.write(f"Main File Format: {output_format}\n")
+        if (output_format != "segments"):
+            sidecar.write(f"Main File Compression: {output_compression}\n")
+        sidecar.write(f"Main File Size: {size_str}\n")
+        if (output_compression and output_format != "segments"):
+            # compressed files have no header, they can only be loaded with their block table
+            sidecar.write(f"Block Table: {main_filename}.blocks\n")
+        if (write_index):
+            sidecar.write(f"Index File: {index_filename}\n")
+        sidecar.write(f"Created: {timestamp}\n")
+        sidecar.write(f"2nd Order Cutoff Freq: {cutoff_freq}Hz\n")
+        sidecar.write(f"Motion Mode: {motion_mode}\n")
+        sidecar.write(f"Corner Velocity: {corner_velocity} mm/s\n")
+        sidecar.write(f"Max Velocity: {max_velocity} mm/s\n")
+        sidecar.write(f"Acceleration: {acceleration} mm/s\n")
+        sidecar.write(f"Total path points: {path.size()}\n")
+        sidecar.write(f"Timestep: {timestep}ms\n")
+        sidecar.write(f"Total Time: {timestep*path.size()/1000}s")
+        if (verify_report):
+            sidecar.write(f"\nVerification:\n{verify_report}")
+    print(f"saved to {os.path.abspath(out_filename)}.txt")
+    print(f"Size:{size_str}")
+
+    print("save time:", time.time()-startTime)
+    # Output is complete, so the run doesn't need to be resumed
+    if (checkpoint_file):
+        remove_checkpoint(checkpoint_file)
+
+
+def add_actuator_columns(pathArray: np.ndarray, timestep: float) -> np.ndarray:
+    """Takes a [N,5] path (time, X, Y, Z, E) sampled every timestep ms and appends the LRA and SRA X/Y columns,
+    giving the layout in output_columns"""
+    # applying second order non-causal filter
+    x_lra = second_order_smooth(pathArray[:, 1], cutoff_freq, timestep)[:, np.newaxis]
+    y_lra = second_order_smooth(pathArray[:, 2], cutoff_freq, timestep)[:, np.newaxis]
+    x_sra = pathArray[:, 1, np.newaxis] - x_lra
+    y_sra = pathArray[:, 2, np.newaxis] - y_lra
+    return np.hstack([pathArray, x_lra, y_lra, x_sra, y_sra])
+
+
+def second_order_smooth(sequence, cutoff_freq, timestep):
+    """Cutoff Freq. in Hz, timestep (between samples) in ms"""
+    alpha = calc_smoothing(cutoff_freq, 1000/timestep)
     smoothed = exp_smooth(sequence, alpha)
     # return smoothed
     return np.flip(exp_smooth(np.flip(smoothed), alpha))
@@ -191,8 +271,9 @@ def inch_to_mm(val: float) -> float:
 
 
 class GCode_parser:
-    def __init__(self, default_feedrate: float) -> None:
-        """Init a gcode parser with the specified default feedrate"""
+    def __init__(self, default_feedrate: float, record_segments: bool = False) -> None:
+        """Init a gcode parser with the specified default feedrate.
+        If record_segments is set, the profile of each move and dwell is also kept, see segment_table()"""
 
         # Public path
         self.path: PathArray = PathArray()
@@ -206,19 +287,151 @@ class GCode_parser:
         # offsets used to ensure G92 zeroing can be handled.
         self.workspace_offsets: np.ndarray = np.zeros(4)
         self.unimplemented_cmds: dict[str, int] = {}
+        # (G-code line number, first output row) of each line that generated output, and of each layer change
+        self._line_rows: list[tuple[int, int]] = []
+        self._layer_rows: list[tuple[int, int]] = []
+        # linear moves waiting to be sampled: (start state, travel, start time, travel time, first row, number of steps)
+        self._pending_moves: list[tuple[np.ndarray, np.ndarray, float, float, int, int]] = []
+        self._pending_rows: int = 0
+        # Time in ms at the end of the last move or dwell, used in "linear" mode. It is not rounded to timesteps,
+        # so short moves don't each round up to a whole step and drift slower than their feedrate
+        self._clock: float = 0.0
+        # rows of each checkpoint stream already saved, see _save_checkpoint
+        self._checkpointed: dict[str, int] = {}
+        # rows of path_formats.SEGMENT_COLUMNS, if recording
+        self._segments: Optional[list[list[float]]] = [] if record_segments else None
 
     def get_axis_index(self, axis: str) -> int:
         """Converts the axis letter to the index needed for state and offsets"""
         return 'xyze'.index(axis)
 
-    def parse_file(self, filename: str) -> PathArray:
+    def segment_table(self) -> np.ndarray:
+        """The recorded moves and dwells, as a [N, len(path_formats.SEGMENT_COLUMNS)] array"""
+        if (self._segments is None):
+            raise ValueError("Parser was not created with record_segments")
+        return np.array(self._segments).reshape(-1, len(path_formats.SEGMENT_COLUMNS))
+
+    def source_index(self) -> dict[str, np.ndarray]:
+        """Maps G-code line numbers (1 based) and layer changes to output rows, see path_formats.write_index"""
+        lines = np.array(self._line_rows, dtype=np.int64).reshape(-1, 2)
+        layers = np.array(self._layer_rows, dtype=np.int64).reshape(-1, 2)
+        return {"line": lines[:, 0], "line_row": lines[:, 1],
+                "layer_line": layers[:, 0], "layer_row": layers[:, 1]}
+
+    def parse_file(self, filename: str, checkpoint_file: Optional[str] = None) -> PathArray:
+        """Parse a G-code file into self.path.\n
+        If checkpoint_file is given, the parser state is saved there every checkpoint_interval lines,
+        and an existing checkpoint for the same file is resumed from. The result is identical to an uninterrupted run."""
         with open(filename, "r") as gcode:
-            for line in (l.removesuffix('\n') for l in gcode):
+            line_no = 0
+            if (checkpoint_file):
+                line_no = self._resume_checkpoint(checkpoint_file, filename, gcode)
+            # readline rather than iterating, as tell() is needed for checkpoints
+            while (line := gcode.readline()):
+                line = line.removesuffix('\n')
+                line_no += 1
+                row = self._output_rows()
+                # Layer changes are marked by PrusaSlicer
+                if (line.startswith(";LAYER_CHANGE")):
+                    self._layer_rows.append((line_no, row))
                 self._parse_line(line)
+                if (self._output_rows() != row):
+                    self._line_rows.append((line_no, row))
+                if (checkpoint_file and line_no % checkpoint_interval == 0):
+                    self._save_checkpoint(checkpoint_file, filename, gcode.tell(), line_no)
+        self._flush_linear_moves()
         # Trim array to actual size
         self.path.trim()
         return self.path
 
+    def _checkpoint_streams(self) -> dict[str, tuple[Sequence, np.dtype, int]]:
+        """The append-only outputs of the parser: (data, dtype, row width). Only rows added since the last checkpoint are written."""
+        streams = {
+            "path": (self.path.get()[:, 1:], np.dtype(np.float64), 4),
+            "lines": (self._line_rows, np.dtype(np.int64), 2),
+            "layers": (self._layer_rows, np.dtype(np.int64), 2),
+        }
+        if (self._segments is not None):
+            streams["segments"] = (self._segments, np.dtype(np.float64), len(path_formats.SEGMENT_COLUMNS))
+        return streams
+
+    def _save_checkpoint(self, checkpoint_file: str, filename: str, offset: int, line_no: int) -> None:
+        """Append new output rows to the checkpoint's stream files, then atomically replace its state file"""
+        self._flush_linear_moves()
+        counts: dict[str, int] = {}
+        for name, (data, dtype, width) in self._checkpoint_streams().items():
+            done = self._checkpointed.get(name, 0)
+            with open(f"{checkpoint_file}.{name}", "ab") as f:
+                np.asarray(data[done:], dtype=dtype).reshape(-1, width).tofile(f)
+                f.flush()
+                os.fsync(f.fileno())
+            counts[name] = len(data)
+
+        state = {
+            "source": os.path.abspath(filename),
+            "source_size": os.path.getsize(filename),
+            "settings": _checkpoint_settings(),
+            "offset": offset,
+            "line_no": line_no,
+            "counts": counts,
+            "state": self._state.tolist(),
+            "last_state": self._last_state.tolist(),
+            "workspace_offsets": self.workspace_offsets.tolist(),
+            "inch_units": self._inch_units,
+            "relative_move": self._relative_move,
+            "relative_e": self._relative_e,
+            "feedrate": self._feedrate,
+            "clock": self._clock,
+            "unimplemented_cmds": self.unimplemented_cmds,
+        }
+        with open(checkpoint_file+".tmp", "w") as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(checkpoint_file+".tmp", checkpoint_file)
+        self._checkpointed = counts
+
+    def _resume_checkpoint(self, checkpoint_file: str, filename: str, gcode: TextIO) -> int:
+        """Restore the parser from checkpoint_file if it was made for this file, seeking gcode to where it stopped.
+        Returns the number of lines already parsed (0 if starting over)"""
+        state = None
+        if (os.path.exists(checkpoint_file)):
+            with open(checkpoint_file) as f:
+                state = json.load(f)
+            if (state["source"] != os.path.abspath(filename) or state["source_size"] != os.path.getsize(filename)
+                    or state.get("settings") != _checkpoint_settings()
+                    or set(state["counts"]) != set(self._checkpoint_streams())):
+                print("Checkpoint does not match this file or the current settings, starting over")
+                state = None
+        if (state is None):
+            remove_checkpoint(checkpoint_file)
+            return 0
+
+        # Streams may hold rows written after the last complete checkpoint, those are dropped
+        for name, (data, dtype, width) in self._checkpoint_streams().items():
+            count = state["counts"][name]
+            with open(f"{checkpoint_file}.{name}", "r+b") as f:
+                f.truncate(count*width*dtype.itemsize)
+            rows = np.fromfile(f"{checkpoint_file}.{name}", dtype=dtype).reshape(-1, width)
+            if (name == "path"):
+                self.path.append(rows)
+            else:
+                data.extend(map(list, rows) if name == "segments" else map(tuple, rows.tolist()))
+        self._checkpointed = dict(state["counts"])
+
+        self._state = np.array(state["state"])
+        self._last_state = np.array(state["last_state"])
+        self.workspace_offsets = np.array(state["workspace_offsets"])
+        self._inch_units = state["inch_units"]
+        self._relative_move = state["relative_move"]
+        self._relative_e = state["relative_e"]
+        self._feedrate = state["feedrate"]
+        self._clock = state["clock"]
+        self.unimplemented_cmds = state["unimplemented_cmds"]
+        gcode.seek(state["offset"])
+        print(f"Resuming from checkpoint at line {state['line_no']}")
+        return state["line_no"]
+
     def _parse_line(self, line: str):
         """Parses a single line of Gcode. Relevant state is stored by the Printer object. If the line is a move or delay, returns an array of position commands: [time, x, y, z, e]. Units are ms and mm respectively"""
         # Remove comments(everything after a semicolon)
@@ -261,36 +474,69 @@ class GCode_parser:
 # Fan commands:        'M106', 'M107'
 # Homing: G28
 
+    def _output_rows(self) -> int:
+        """Rows generated so far, including linear moves not yet sampled"""
+        return self.path.size() + self._pending_rows
+
     def _generate_move_steps(self) -> None:
-        # dist/feedrate = time
         travel = self._state - self._last_state
         # Euclydian distance of X and Y
         dist = float(np.linalg.norm(travel[:2]))
-        angle = np.arctan2(travel[1], travel[0]) # get angle of path segment
-        z_dist = float(travel[2])
-        e_dist = float(travel[3])
+        if (motion_mode == "linear"):
+            self._queue_linear_move(travel, dist)
+            return
         # interpolate between the two positions,
         # using acceleration and deceleration in X and Y
         # TODO: End vel is not handled properly, should probably be stored and used to adjust next move
         easing, end_vel = accel_curves.acc_spline(
             dist, corner_velocity, corner_velocity)
-        norm_ease = easing/dist
-        # Note - lists are stacked then transposed to match the rest of the data
-        points = np.vstack((np.cos(angle)*easing, np.sin(angle)*easing,
-                           z_dist*norm_ease, e_dist*norm_ease)).T
-        
-        points = points + self._last_state
-        self.path.append(points)
-        return
-        # OLD - linear interpolation version
-        # Feedrate in mm/s, so convert from sec->millisec
-        feed = feedrate_override
-        travel_time = dist/feed*1000
-        num_steps = int(np.ceil(travel_time/timestep))
-        self.path.append(np.linspace(
-            self._last_state, self._state, num_steps, endpoint=False))
+        if (self._segments is not None):
+            vm, _, t_acc, t_cruise, t_deacc = accel_curves.spline_phases(
+                dist, corner_velocity, corner_velocity)
+            self._segments.append([path_formats.SEGMENT_MOVE, *self._last_state, *travel, dist, corner_velocity,
+                                   vm, corner_velocity, t_acc, t_cruise, t_deacc, 0.0, self.path.size()*timestep])
+        self.path.append(accel_curves.spline_points(self._last_state, travel, easing))
+
+    def _queue_linear_move(self, travel: np.ndarray, dist: float) -> None:
+        """Constant velocity move at the current feedrate. Moves are queued and sampled in batches by _flush_linear_moves"""
+        # Z moves at the feedrate as well, whichever axis takes longer sets the time
+        length = max(dist, abs(float(travel[2])))
+        # Feedrate is in mm/min, so convert to mm/s. travel_time is in ms
+        feed = self._feedrate/60
+        t_move = length/feed
+        travel_time = t_move*1000
+        t_start = self._clock
+        self._clock = t_start + travel_time
+        # The move gets the rows whose time falls in [t_start, t_start+travel_time)
+        first_row = math.ceil(t_start/timestep)
+        num_steps = math.ceil(self._clock/timestep) - first_row
+        if (self._segments is not None):
+            self._segments.append([path_formats.SEGMENT_MOVE, *self._last_state, *travel,
+                                   length, feed, feed, feed, 0.0, t_move, 0.0, 0.0, t_start])
+        if (num_steps == 0):
+            return
+        self._pending_moves.append((self._last_state, travel, t_start, travel_time, first_row, num_steps))
+        self._pending_rows += num_steps
+        if (len(self._pending_moves) >= linear_batch_size):
+            self._flush_linear_moves()
+
+    def _flush_linear_moves(self) -> None:
+        """Sample all queued linear moves in one pass, at the times of their rows"""
+        if (not self._pending_moves):
+            return
+        starts, travels, t_starts, travel_times, first_rows, steps = zip(*self._pending_moves)
+        counts = np.array(steps)
+        # move index and row number, for every output row
+        move = np.repeat(np.arange(len(counts)), counts)
+        row = np.arange(self._pending_rows) - np.repeat(np.cumsum(counts) - counts - np.array(first_rows), counts)
+        frac = ((row*timestep - np.array(t_starts)[move]) / np.array(travel_times)[move])[:, np.newaxis]
+        self.path.append(np.array(starts)[move] + np.array(travels)[move]*frac)
+        self._pending_moves.clear()
+        self._pending_rows = 0
 
     def _generate_dwell_steps(self, cmds: list[str]):
+        # queued moves come before the dwell
+        self._flush_linear_moves()
         delay: float = 0.0  # in milliseconds
         for cmd in cmds:
             # S command takes precedence, if both are specified
@@ -300,8 +546,16 @@ class GCode_parser:
             if (cmd[0].lower() == 'p' and delay == 0.0):
                 delay = float(cmd[1:])
 
+        t_start = self._clock if motion_mode == "linear" else self.path.size()*timestep
+        if (self._segments is not None):
+            self._segments.append([path_formats.SEGMENT_DWELL, *self._state, 0.0, 0.0, 0.0, 0.0,
+                                   0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, delay, t_start])
         # Build array
-        num_steps = int(np.ceil(delay/timestep))
+        if (motion_mode == "linear"):
+            self._clock = t_start + delay
+            num_steps = math.ceil(self._clock/timestep) - math.ceil(t_start/timestep)
+        else:
+            num_steps = int(np.ceil(delay/timestep))
         self.path.append(self._state.reshape(1, 4).repeat(num_steps, axis=0))
 
     def _parse_movement(self, cmds: list[str]) -> None:
@@ -330,7 +584,7 @@ class GCode_parser:
                 else:
                     val += self.workspace_offsets[3]
                 self._state[3] = val
-            elif (axis == 'f'):
+            elif (axis == 'f' and val > 0):  # a zero or negative feedrate is invalid, keep the last one
                 self._feedrate = val
 
     def updateOffsets(self, cmds: list[str]) -> None:
@@ -349,6 +603,24 @@ class GCode_parser:
             self.workspace_offsets[i] = curr_pos - new_val
 
 
+def _checkpoint_settings() -> dict[str, object]:
+    """Config that changes the generated path. A checkpoint is only resumed if these match the current values"""
+    return {
+        "timestep": timestep,
+        "motion_mode": motion_mode,
+        "acceleration": acceleration,
+        "max_velocity": max_velocity,
+        "corner_velocity": corner_velocity,
+    }
+
+
+def remove_checkpoint(checkpoint_file: str) -> None:
+    """Delete a checkpoint and its stream files, if they exist"""
+    for ext in ("", ".tmp", ".path", ".lines", ".layers", ".segments"):
+        if (os.path.exists(checkpoint_file+ext)):
+            os.remove(checkpoint_file+ext)
+
+
 def size_as_str(size_bytes: int) -> str:
     """
     Convert the file size from bytes to a human-readable format.
@@ -369,10 +641,4 @@ def size_as_str(size_bytes: int) -> str:
 
 
 if __name__ == "__main__":
-    # feedrates = [100, 200, 300, 400, 500, 600, 700, 800, 900, 1000, 1100, 1200, 1300, 1400]
-    # feedrates = [405, 1300, 1400]
-
-    # for feed in feedrates:
-    #     feedrate_override = feed
-    #     main()
     exit(main())
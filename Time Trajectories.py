@@ -1,3 +1,4 @@
+# Legacy script, superseded by motion_mode = "linear" in GcodeToPath.py
 import math
 import pandas as pd
 import time
@@ -1,8 +1,6 @@
 import math
 import numpy as np
-from matplotlib import pyplot as plt
 import GcodeToPath
-from LivePlotting import LivePlot2D
 
 # constants
 hz = 1000/GcodeToPath.timestep  # sample rate (1/s)
@@ -10,9 +8,11 @@ v_max = GcodeToPath.max_velocity  # in mm/s
 acc: float = GcodeToPath.acceleration  # m/s^2
 
 
-def acc_spline(dist: float, vi: float, vf: float) -> tuple[np.ndarray, float]:
+def acc_spline(dist: float, vi: float, vf: float,
+               hz: float = hz, acc: float = acc, v_max: float = v_max) -> tuple[np.ndarray, float]:
     """A 1D interpolation between the start/end positions and velocities with constant acceleration and deceleration.\n
     dist, vi, and vf must be positive. vi and vf must be < max_vel. \n
+    The sample rate (1/s), acceleration and max velocity default to the module constants, from the GcodeToPath config.
     Returns the interpolated array and the achieved final velocity (might be lower than target end velocity)"""
 
     # max velocity you could accelerate too, ignoring max_vel
@@ -73,6 +73,39 @@ def acc_spline(dist: float, vi: float, vf: float) -> tuple[np.ndarray, float]:
         return np.concatenate([acc_vec, cv_vec, deacc_vec]), vf
 
 
+def spline_phases(dist: float, vi: float, vf: float) -> tuple[float, float, float, float, float]:
+    """Describes the profile acc_spline follows, rather than sampling it.\n
+    dist, vi, and vf must be positive. vi and vf must be < max_vel. \n
+    Returns (vm, vf_act, t_acc, t_cruise, t_deacc): the peak and achieved final velocity in mm/s, and the duration of each phase in s"""
+    act_vm = math.sqrt(acc*dist + .5*(vi**2 + vf**2))
+
+    if (act_vm < vf):  # acceleration only, vf is not reached
+        vf_act = math.sqrt(vi*vi + 2*acc*dist)
+        return vf_act, vf_act, (vf_act-vi)/acc, 0.0, 0.0
+    if (act_vm < vi):  # deceleration only, we cannot slow down to vf
+        vf_act = math.sqrt(max(vi*vi - 2*acc*dist, 0.0))
+        return vi, vf_act, 0.0, 0.0, (vi-vf_act)/acc
+    if (act_vm <= v_max):  # acc/deacc, no constant velocity section
+        return act_vm, vf, (act_vm-vi)/acc, 0.0, (act_vm-vf)/acc
+
+    acc_dist = (v_max**2 - vi**2)/(2*acc)
+    deacc_dist = (v_max**2 - vf**2)/(2*acc)
+    t_cruise = (dist - acc_dist - deacc_dist)/v_max
+    return v_max, vf, (v_max-vi)/acc, t_cruise, (v_max-vf)/acc
+
+
+def spline_points(start: np.ndarray, travel: np.ndarray, easing: np.ndarray) -> np.ndarray:
+    """The [N,4] X, Y, Z, E positions along a straight move from start by travel, at the XY distances in easing (from acc_spline).\n
+    Z and E move in proportion to the XY distance covered"""
+    dist = float(np.linalg.norm(travel[:2]))
+    angle = np.arctan2(travel[1], travel[0])  # get angle of path segment
+    norm_ease = easing/dist
+    # Note - lists are stacked then transposed to match the rest of the data
+    points = np.vstack((np.cos(angle)*easing, np.sin(angle)*easing,
+                       float(travel[2])*norm_ease, float(travel[3])*norm_ease)).T
+    return points + start
+
+
 def _update(frame: int, slider):
     accel, end_vel = acc_spline(slider.val, 300, 100)
 
@@ -82,5 +115,5 @@ def _update(frame: int, slider):
 
 
 if __name__ == "__main__":
-
+    from LivePlotting import LivePlot2D
     LivePlot2D((0, 100), _update, 4, marker='.')  # type: ignore
@@ -0,0 +1,392 @@
+import gzip
+import io
+import json
+import lzma
+import math
+import os
+import struct
+import numpy as np
+import accel_curves
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import BinaryIO, Optional
+
+# Binary path file layout:
+#   4 bytes  magic (b"GTPB")
+#   4 bytes  little-endian uint32, length of the JSON header
+#   N bytes  UTF-8 JSON header (timestep, column names, dtype, scale...), padded to 8 bytes
+#   ...      row-major data, one row per timestep, of the header's stored_columns. The time column is not stored,
+#            it is rebuilt from t0 + row*timestep, and neither are the derived columns (see DERIVED_COLUMNS)
+BINARY_MAGIC = b"GTPB"
+BINARY_VERSION = 1
+FIXED_POINT_SCALE = 0.001  # in mm per count, for the i32 format
+chunk_rows = 65536  # rows converted per write, keeps the temporary arrays small
+csv_offset_rows = 10000  # rows between the byte offsets write_csv records, for seeking in CSV files
+# Columns that are the difference of two others (the SRA is Ref - LRA). Binary formats rebuild them on load
+DERIVED_COLUMNS = {"xSRA": ("xRef", "xLRA"), "ySRA": ("yRef", "yLRA")}
+
+# Parametric (segment table) files use the same header, with float64 rows of SEGMENT_COLUMNS.
+# kind is SEGMENT_MOVE or SEGMENT_DWELL. Moves follow a trapezoidal profile along the travel vector,
+# velocities are in mm/s and phase durations in s. vi and vf are the velocities requested from acc_spline,
+# the phases describe the profile it follows (see accel_curves.spline_phases). Dwells hold start_* for dwell_ms.
+# t_start is the start time in ms. In "linear" motion mode it is the unrounded time that sets which rows a segment gets
+SEGMENT_COLUMNS = ["kind", "start_x", "start_y", "start_z", "start_e", "travel_x", "travel_y", "travel_z", "travel_e",
+                   "dist", "vi", "vm", "vf", "t_acc", "t_cruise", "t_deacc", "dwell_ms", "t_start"]
+_seg = {name: i for i, name in enumerate(SEGMENT_COLUMNS)}
+SEGMENT_MOVE = 0
+SEGMENT_DWELL = 1
+
+# Compressed path files are a series of independently compressed blocks of compress_block_rows rows,
+# so they can be decompressed with standard tools (gzip and xz both accept concatenated streams).
+# The block table (row and byte offsets of each block) is written next to it, as <filename>.blocks
+compress_block_rows = 50000
+_codecs = {
+    "gzip": (".gz", gzip.compress, gzip.decompress),
+    "lzma": (".xz", lzma.compress, lzma.decompress),
+}
+
+_binary_dtypes = {"f32": np.dtype("<f4"), "i32": np.dtype("<i4")}
+_i32_limit = np.iinfo(np.int32).max
+
+
+def binary_formats() -> tuple[str, ...]:
+    return tuple(_binary_dtypes)
+
+
+def compressed_extension(codec: str) -> str:
+    return _codecs[codec][0]
+
+
+def encode_rows(rows: np.ndarray, fmt: str) -> np.ndarray:
+    """Convert rows of float64 positions to the on-disk dtype of a binary format"""
+    if (fmt == "i32"):
+        rows = np.rint(rows / FIXED_POINT_SCALE)
+        if (rows.size and np.max(np.abs(rows)) > _i32_limit):
+            raise ValueError("Path values are out of range for i32 fixed-point output")
+    return rows.astype(_binary_dtypes[fmt], copy=False)
+
+
+def decode_rows(rows: np.ndarray, fmt: str, scale: float) -> np.ndarray:
+    """Inverse of encode_rows, always returns float64. scale is the one recorded in the file's header"""
+    if (fmt == "i32"):
+        return rows * scale
+    return rows.astype(np.float64)
+
+
+def _binary_layout(columns: list[str]) -> tuple[list[str], dict[str, list[str]]]:
+    """The columns a binary file stores, and the derived columns rebuilt from them on load"""
+    derived = {name: list(sources) for name, sources in DERIVED_COLUMNS.items()
+               if name in columns and all(c in columns for c in sources)}
+    return [c for c in columns[1:] if c not in derived], derived
+
+
+def _rebuild_rows(stored: np.ndarray, times: np.ndarray, header: dict) -> np.ndarray:
+    """Full rows in the CSV layout, from decoded stored columns"""
+    columns = header["columns"]
+    out = np.empty((len(stored), len(columns)))
+    out[:, 0] = times
+    out[:, [columns.index(c) for c in header["stored_columns"]]] = stored
+    for name, (a, b) in header["derived"].items():
+        out[:, columns.index(name)] = out[:, columns.index(a)] - out[:, columns.index(b)]
+    return out
+
+
+def write_binary(filename: str, path_array: np.ndarray, columns: list[str], timestep: float, fmt: str = "f32") -> None:
+    """Write a path array (time in column 0) as a compact binary file.\n
+    fmt is "f32" for float32 or "i32" for int32 fixed-point at FIXED_POINT_SCALE resolution.
+    Rows are converted in chunks straight from path_array, so no full size copy is made.
+    With the 9 output columns, 6 are stored in 24 bytes a row, about 2.9x smaller than the CSV.
+    Use write_compressed for more."""
+    if (fmt not in _binary_dtypes):
+        raise ValueError(f"Unknown binary format: {fmt}")
+    header = _binary_header(path_array, columns, timestep, fmt)
+    stored = [columns.index(c) for c in header["stored_columns"]]
+    with open(filename, "wb") as out:
+        _write_header(out, header)
+        for start in range(0, len(path_array), chunk_rows):
+            encode_rows(path_array[start:start+chunk_rows, stored], fmt).tofile(out)
+
+
+def _binary_header(path_array: np.ndarray, columns: list[str], timestep: float, fmt: str) -> dict:
+    stored_columns, derived = _binary_layout(list(columns))
+    return {
+        "version": BINARY_VERSION,
+        "format": fmt,
+        "dtype": _binary_dtypes[fmt].str,
+        "scale": FIXED_POINT_SCALE if fmt == "i32" else 1.0,
+        "timestep": timestep,
+        "t0": float(path_array[0, 0]) if len(path_array) else 0.0,
+        "rows": len(path_array),
+        "columns": list(columns),
+        "stored_columns": stored_columns,
+        "derived": derived,
+    }
+
+
+def _write_header(out: BinaryIO, header: dict) -> None:
+    header_bytes = json.dumps(header).encode()
+    # pad so the data starts 8 byte aligned, which allows memory mapping
+    header_bytes += b" " * (-(len(BINARY_MAGIC) + 4 + len(header_bytes)) % 8)
+    out.write(BINARY_MAGIC)
+    out.write(struct.pack("<I", len(header_bytes)))
+    out.write(header_bytes)
+
+
+def read_binary_header(filename: str) -> tuple[dict, int]:
+    """Returns the header of a binary path file and the byte offset of its first row"""
+    with open(filename, "rb") as f:
+        if (f.read(len(BINARY_MAGIC)) != BINARY_MAGIC):
+            raise ValueError(f"{filename} is not a binary path file")
+        (header_len,) = struct.unpack("<I", f.read(4))
+        header = json.loads(f.read(header_len))
+    return header, len(BINARY_MAGIC) + 4 + header_len
+
+
+def load_binary(filename: str, start: int = 0, stop: Optional[int] = None) -> np.ndarray:
+    """Load rows [start, stop) of a binary path file, as a float64 array in the same layout as the CSV output (time in column 0).
+    Only the requested rows are read from disk."""
+    header, offset = read_binary_header(filename)
+    n_rows = header["rows"]
+    stop = n_rows if stop is None else min(stop, n_rows)
+    start = max(0, min(start, stop))
+    if (n_rows == 0):
+        return np.zeros((0, len(header["columns"])))
+
+    data = np.memmap(filename, dtype=np.dtype(header["dtype"]), mode="r", offset=offset,
+                     shape=(n_rows, len(header["stored_columns"])))
+    times = header["t0"] + np.arange(start, stop)*header["timestep"]
+    return _rebuild_rows(decode_rows(data[start:stop], header["format"], header["scale"]), times, header)
+
+
+def write_segments(filename: str, segments: np.ndarray, timestep: float, acceleration: float, max_velocity: float,
+                   motion_mode: str = "accel") -> None:
+    """Write a segment table ([N, len(SEGMENT_COLUMNS)] array) as a parametric path file"""
+    header = {
+        "version": BINARY_VERSION,
+        "format": "segments",
+        "dtype": "<f8",
+        "timestep": timestep,
+        "acceleration": acceleration,
+        "max_velocity": max_velocity,
+        "motion_mode": motion_mode,
+        "rows": len(segments),
+        "columns": SEGMENT_COLUMNS,
+    }
+    with open(filename, "wb") as out:
+        _write_header(out, header)
+        np.ascontiguousarray(segments, dtype="<f8").tofile(out)
+
+
+def load_segments(filename: str) -> tuple[dict, np.ndarray]:
+    """Returns the header and segment table of a parametric path file"""
+    header, offset = read_binary_header(filename)
+    if (header["format"] != "segments"):
+        raise ValueError(f"{filename} is not a parametric path file")
+    segments = np.fromfile(filename, dtype=np.dtype(header["dtype"]), offset=offset)
+    return header, segments.reshape(header["rows"], len(header["columns"]))
+
+
+def reconstruct_path(segments: np.ndarray, timestep: float, acceleration: float, max_velocity: float,
+                     motion_mode: str = "accel") -> np.ndarray:
+    """Sample a segment table at timestep (in ms), returning a [N,5] array of time, X, Y, Z and E like PathArray.\n
+    Segments are sampled like GCode_parser does for motion_mode (acceleration, max_velocity and motion_mode are in the
+    file header). In "accel" mode each move is sampled by acc_spline, in "linear" mode each segment gets the rows whose
+    time falls between its unrounded start and end times.
+    At the parser's timestep the result is identical to its path."""
+    if (motion_mode == "linear"):
+        return _reconstruct_linear(segments, timestep)
+    hz = 1000/timestep
+    pieces = []
+    for segment in segments:
+        start = segment[_seg["start_x"]:_seg["start_e"]+1]
+        if (segment[_seg["kind"]] == SEGMENT_DWELL):
+            pieces.append(start.reshape(1, 4).repeat(int(np.ceil(segment[_seg["dwell_ms"]]/timestep)), axis=0))
+            continue
+        easing, _ = accel_curves.acc_spline(float(segment[_seg["dist"]]), segment[_seg["vi"]], segment[_seg["vf"]],
+                                            hz, acceleration, max_velocity)
+        pieces.append(accel_curves.spline_points(start, segment[_seg["travel_x"]:_seg["travel_e"]+1], easing))
+
+    points = np.concatenate(pieces) if pieces else np.empty((0, 4))
+    out = np.empty((len(points), 5))
+    out[:, 0] = np.arange(len(points))*timestep
+    out[:, 1:] = points
+    return out
+
+
+def _reconstruct_linear(segments: np.ndarray, timestep: float) -> np.ndarray:
+    kind = segments[:, _seg["kind"]]
+    t_start = segments[:, _seg["t_start"]]
+    t_end = t_start + np.where(kind == SEGMENT_DWELL, segments[:, _seg["dwell_ms"]], segments[:, _seg["t_cruise"]]*1000)
+    first_rows = np.ceil(t_start/timestep).astype(np.int64)
+    counts = np.ceil(t_end/timestep).astype(np.int64) - first_rows
+    total = int(counts.sum())
+
+    # Per sample segment index and row number
+    seg = np.repeat(np.arange(len(segments)), counts)
+    starts = np.cumsum(counts) - counts
+    s_tab = segments[seg]
+    row = np.arange(total) - (starts - first_rows)[seg]
+    # constant velocity, so the fraction of the move done is the fraction of its time elapsed
+    travel_time = s_tab[:, _seg["t_cruise"]]*1000
+    frac = np.divide(row*timestep - s_tab[:, _seg["t_start"]], travel_time,
+                     out=np.zeros(total), where=travel_time > 0)
+
+    out = np.empty((total, 5))
+    out[:, 0] = np.arange(total)*timestep
+    out[:, 1:] = s_tab[:, _seg["start_x"]:_seg["start_e"]+1] + s_tab[:, _seg["travel_x"]:_seg["travel_e"]+1]*frac[:, np.newaxis]
+    return out
+
+
+def write_compressed(filename: str, path_array: np.ndarray, columns: list[str], timestep: float,
+                     fmt: str = "csv", codec: str = "gzip", workers: Optional[int] = None) -> None:
+    """Stream a path array (time in column 0) to filename as independently compressed blocks, in "csv" text or a binary format.\n
+    Blocks are formatted here while earlier blocks are compressed in a thread pool of workers threads (default: CPU count),
+    and are written in order as they finish. The block table is written to filename + ".blocks" for load_compressed"""
+    compress = _codecs[codec][1]
+    workers = workers or os.cpu_count() or 1
+    blocks: list[list[int]] = []  # row start, row count, byte offset, byte length
+    pending: deque[tuple[int, int, Future[bytes]]] = deque()
+
+    with open(filename, "wb") as out, ThreadPoolExecutor(workers) as pool:
+        def write_oldest():
+            row_start, row_count, compressed = pending.popleft()
+            data = compressed.result()
+            blocks.append([row_start, row_count, out.tell(), len(data)])
+            out.write(data)
+
+        for start in range(0, len(path_array), compress_block_rows):
+            rows = path_array[start:start+compress_block_rows]
+            raw = _format_block(rows, columns, fmt, header=(start == 0))
+            pending.append((start, len(rows), pool.submit(compress, raw)))
+            # bound the number of blocks held in memory
+            if (len(pending) > 2*workers):
+                write_oldest()
+        while (pending):
+            write_oldest()
+
+    if (fmt == "csv"):
+        table = {"version": BINARY_VERSION, "format": fmt, "timestep": timestep,
+                 "rows": len(path_array), "columns": list(columns)}
+    else:
+        table = _binary_header(path_array, columns, timestep, fmt)
+    table["codec"] = codec
+    table["blocks"] = blocks
+    with open(filename+".blocks", "w") as f:
+        json.dump(table, f)
+
+
+def _format_block(rows: np.ndarray, columns: list[str], fmt: str, header: bool) -> bytes:
+    if (fmt == "csv"):
+        buf = io.BytesIO()
+        np.savetxt(buf, rows, delimiter=",", fmt='%.3f',
+                   header=", ".join(columns) if header else "")
+        return buf.getvalue()
+    stored_columns, _ = _binary_layout(list(columns))
+    return encode_rows(rows[:, [columns.index(c) for c in stored_columns]], fmt).tobytes()
+
+
+def _parse_block(raw: bytes, row_start: int, table: dict) -> np.ndarray:
+    if (table["format"] == "csv"):
+        return np.loadtxt(io.BytesIO(raw), delimiter=",", ndmin=2)
+    data = np.frombuffer(raw, dtype=np.dtype(table["dtype"])).reshape(-1, len(table["stored_columns"]))
+    times = table["t0"] + (row_start + np.arange(len(data)))*table["timestep"]
+    return _rebuild_rows(decode_rows(data, table["format"], table["scale"]), times, table)
+
+
+def load_compressed(filename: str, start: int = 0, stop: Optional[int] = None) -> np.ndarray:
+    """Load rows [start, stop) of a compressed path file, in the same layout as the CSV output.
+    Only the blocks overlapping the requested rows are read and decompressed."""
+    with open(filename+".blocks") as f:
+        table = json.load(f)
+    decompress = _codecs[table["codec"]][2]
+    stop = table["rows"] if stop is None else min(stop, table["rows"])
+
+    parts = [np.zeros((0, len(table["columns"])))]
+    with open(filename, "rb") as f:
+        for row_start, row_count, offset, length in table["blocks"]:
+            if (row_start + row_count <= start or row_start >= stop):
+                continue
+            f.seek(offset)
+            rows = _parse_block(decompress(f.read(length)), row_start, table)
+            parts.append(rows[max(start-row_start, 0):stop-row_start])
+    return np.vstack(parts)
+
+
+def write_csv(filename: str, path_array: np.ndarray, columns: list[str]) -> np.ndarray:
+    """Write a path array as CSV, like np.savetxt.\n
+    Returns the byte offset of every csv_offset_rows-th row, for write_index, so load_path can seek to a row"""
+    offsets = []
+    with open(filename, "wb") as out:
+        np.savetxt(out, path_array[:0], header=", ".join(columns))
+        for start in range(0, len(path_array), csv_offset_rows):
+            offsets.append(out.tell())
+            np.savetxt(out, path_array[start:start+csv_offset_rows], delimiter=",", fmt='%.3f')
+    return np.array(offsets, dtype=np.int64)
+
+
+def load_path(filename: str, start: int = 0, stop: Optional[int] = None,
+              index: Optional[dict[str, np.ndarray]] = None) -> np.ndarray:
+    """Load rows [start, stop) of any sampled path file written by GcodeToPath (CSV, binary or compressed).\n
+    A CSV is parsed from the start of the file up to stop, unless index (from load_index) has its row offsets"""
+    if (os.path.exists(filename+".blocks")):
+        return load_compressed(filename, start, stop)
+    if (filename.endswith(".bin")):
+        return load_binary(filename, start, stop)
+    with open(filename, "rb") as f:
+        n_cols = len(f.readline().split(b","))
+        if (stop is not None and stop <= start):
+            return np.zeros((0, n_cols))
+        skip = start
+        if (index is not None and "csv_offsets" in index and start // csv_offset_rows < len(index["csv_offsets"])):
+            f.seek(int(index["csv_offsets"][start // csv_offset_rows]))
+            skip = start % csv_offset_rows
+        return np.loadtxt(f, delimiter=",", ndmin=2, skiprows=skip,
+                          max_rows=None if stop is None else stop-start).reshape(-1, n_cols)
+
+
+def write_index(filename: str, source_index: dict[str, np.ndarray], timestep: float, rows: int,
+                csv_offsets: Optional[np.ndarray] = None) -> None:
+    """Save the G-code line/layer to output row index from GCode_parser.source_index(), as an .npz file.
+    csv_offsets are the row offsets from write_csv, if the output is an uncompressed CSV"""
+    if (csv_offsets is not None):
+        source_index = dict(source_index, csv_offsets=csv_offsets)
+    np.savez(filename, timestep=timestep, rows=rows, **source_index)
+
+
+def load_index(filename: str) -> dict[str, np.ndarray]:
+    with np.load(filename) as index:
+        return {k: index[k] for k in index.files}
+
+
+def rows_for_lines(index: dict[str, np.ndarray], first_line: int, last_line: int) -> tuple[int, int]:
+    """Output rows [start, stop) generated by G-code lines first_line to last_line (inclusive, 1 based)"""
+    lines, line_rows = index["line"], index["line_row"]
+    i = np.searchsorted(lines, first_line)
+    j = np.searchsorted(lines, last_line, side="right")
+    start = int(line_rows[i]) if i < len(lines) else int(index["rows"])
+    stop = int(line_rows[j]) if j < len(lines) else int(index["rows"])
+    return start, stop
+
+
+def rows_for_layer(index: dict[str, np.ndarray], layer: int) -> tuple[int, int]:
+    """Output rows [start, stop) of a layer, counting from 0 at the first layer change"""
+    layer_rows = index["layer_row"]
+    stop = int(layer_rows[layer+1]) if layer+1 < len(layer_rows) else int(index["rows"])
+    return int(layer_rows[layer]), stop
+
+
+def rows_for_time(index: dict[str, np.ndarray], t_start: float, t_end: float) -> tuple[int, int]:
+    """Output rows [start, stop) covering t_start to t_end, in ms"""
+    timestep = float(index["timestep"])
+    rows = int(index["rows"])
+    return min(max(0, math.floor(t_start/timestep)), rows), min(max(0, math.floor(t_end/timestep)+1), rows)
+
+
+def row_time(index: dict[str, np.ndarray], row: int) -> float:
+    """Time of an output row, in ms"""
+    return row*float(index["timestep"])
+
+
+def load_lines(filename: str, index: dict[str, np.ndarray], first_line: int, last_line: int) -> np.ndarray:
+    """Load only the output rows generated by G-code lines first_line to last_line (inclusive, 1 based)"""
+    return load_path(filename, *rows_for_lines(index, first_line, last_line), index=index)
@@ -0,0 +1,123 @@
+import numpy as np
+from dataclasses import dataclass, field
+from typing import Optional
+
+# Columns of the generated path (see GcodeToPath.output_columns) checked as XY pairs
+SIGNALS = {"Ref": (1, 2), "LRA": (5, 6), "SRA": (7, 8)}
+verify_chunk_rows = 200000  # rows differentiated at a time
+max_reported_spans = 5  # violation spans listed per limit in the report
+
+
+@dataclass
+class LimitCheck:
+    """Samples of one signal that exceeded a limit, grouped into spans of consecutive rows"""
+    limit: float
+    count: int = 0
+    span_count: int = 0
+    spans: list[list[float]] = field(default_factory=list)  # start row, end row (inclusive), peak value
+    _last_row: int = -2
+
+    def add(self, rows: np.ndarray, values: np.ndarray) -> None:
+        """rows are the (ascending) flagged row numbers of a chunk, values the magnitudes at those rows"""
+        if (len(rows) == 0):
+            return
+        self.count += len(rows)
+        # split into runs of consecutive rows
+        breaks = np.flatnonzero(np.diff(rows) != 1) + 1
+        for run_rows, run_vals in zip(np.split(rows, breaks), np.split(values, breaks)):
+            peak = float(np.max(run_vals))
+            # continues a span from the previous chunk
+            if (run_rows[0] == self._last_row + 1 and self.span_count):
+                if (self.span_count <= max_reported_spans):
+                    self.spans[-1][1] = int(run_rows[-1])
+                    self.spans[-1][2] = max(self.spans[-1][2], peak)
+            else:
+                self.span_count += 1
+                if (self.span_count <= max_reported_spans):
+                    self.spans.append([int(run_rows[0]), int(run_rows[-1]), peak])
+            self._last_row = int(run_rows[-1])
+
+
+@dataclass
+class SignalReport:
+    """Peak XY velocity (mm/s), acceleration (mm/s^2) and jerk (mm/s^3) of one signal, and any limit violations"""
+    name: str
+    max_velocity: float = 0.0
+    max_acceleration: float = 0.0
+    max_jerk: float = 0.0
+    max_travel: float = 0.0  # largest single axis displacement, only checked for the SRA
+    checks: dict[str, LimitCheck] = field(default_factory=dict)
+
+
+def verify_path(path_array: np.ndarray, timestep: float, max_velocity: float, acceleration: float,
+                sra_travel: Optional[float], tolerance: float = 1.01) -> list[SignalReport]:
+    """Differentiate the Ref, LRA and SRA columns of a generated path (timestep in ms) in chunks,
+    and flag samples exceeding max_velocity (Ref and LRA), acceleration (LRA) or +/- sra_travel (SRA, if not None).\n
+    The Ref acceleration is not checked: the velocity changes direction instantly at every corner, which the LRA smooths out.
+    Limits are scaled by tolerance, to allow for the finite differences straddling profile phases."""
+    dt = timestep/1000
+    reports = {name: SignalReport(name) for name in SIGNALS}
+    reports["Ref"].checks["velocity"] = LimitCheck(max_velocity*tolerance)
+    reports["LRA"].checks["velocity"] = LimitCheck(max_velocity*tolerance)
+    reports["LRA"].checks["acceleration"] = LimitCheck(acceleration*tolerance)
+    if (sra_travel is not None):
+        reports["SRA"].checks["travel"] = LimitCheck(sra_travel*tolerance)
+
+    n_rows = len(path_array)
+    for start in range(0, n_rows, verify_chunk_rows):
+        stop = min(start+verify_chunk_rows, n_rows)
+        # 3 rows of overlap, so every row gets its jerk from the previous ones
+        first = max(start-3, 0)
+        for name, cols in SIGNALS.items():
+            report = reports[name]
+            xy = path_array[first:stop, cols]
+            # derivative magnitudes, each one belonging to the last row it was computed from
+            vel = np.diff(xy, axis=0)/dt
+            acc = np.diff(vel, axis=0)/dt
+            jerk = np.diff(acc, axis=0)/dt
+            derived = {"velocity": (np.hypot(vel[:, 0], vel[:, 1]), first+1),
+                       "acceleration": (np.hypot(acc[:, 0], acc[:, 1]), first+2),
+                       "jerk": (np.hypot(jerk[:, 0], jerk[:, 1]), first+3)}
+
+            for kind, (mag, row0) in derived.items():
+                # drop the values of the overlap rows, they were handled by the last chunk
+                mag = mag[max(start-row0, 0):]
+                row0 = max(start, row0)
+                if (len(mag) == 0):
+                    continue
+                setattr(report, f"max_{kind}", max(getattr(report, f"max_{kind}"), float(np.max(mag))))
+                check = report.checks.get(kind)
+                if (check is not None):
+                    flagged = np.flatnonzero(mag > check.limit)
+                    check.add(flagged + row0, mag[flagged])
+
+            if (name == "SRA"):
+                travel = np.max(np.abs(path_array[start:stop, cols]), axis=1)
+                report.max_travel = max(report.max_travel, float(np.max(travel)))
+                check = report.checks.get("travel")
+                if (check is not None):
+                    flagged = np.flatnonzero(travel > check.limit)
+                    check.add(flagged + start, travel[flagged])
+    return list(reports.values())
+
+
+def format_report(reports: list[SignalReport], timestep: float) -> str:
+    """A compact, human readable summary of verify_path's results, for the sidecar file"""
+    lines = []
+    for report in reports:
+        line = (f"{report.name}: max v {report.max_velocity:.1f} mm/s, max a {report.max_acceleration:.0f} mm/s^2, "
+                f"max j {report.max_jerk:.3g} mm/s^3")
+        if (report.name == "SRA"):
+            line += f", max travel {report.max_travel:.3f} mm" + ("" if "travel" in report.checks else " (not checked)")
+        lines.append(line)
+        for kind, check in report.checks.items():
+            if (check.count == 0):
+                continue
+            spans = ", ".join(f"{s[0]*timestep/1000:.3f}-{s[1]*timestep/1000:.3f}s (peak {s[2]:.4g})"
+                              for s in check.spans)
+            more = f" ... +{check.span_count-len(check.spans)} more" if check.span_count > len(check.spans) else ""
+            lines.append(f"  {kind} over {check.limit:.4g}: {check.count} samples in {check.span_count} spans: "
+                         f"{spans}{more}")
+    violations = sum(c.count for r in reports for c in r.checks.values())
+    lines.append(f"Violations: {violations}")
+    return "\n".join(lines)
@@ -0,0 +1,99 @@
+# PrusaSlicer post-processing hook, backed by an optional warm worker.
+# Start the worker once with `python path_worker.py --serve`, and set the post-processing script to `python path_worker.py`.
+# The hook only imports the standard library: it hands the G-code file to the worker over a Unix socket
+# and waits for the result. If no worker is running, the file is processed in this interpreter instead.
+import io
+import json
+import os
+import socket
+import sys
+from contextlib import redirect_stdout
+from typing import Optional
+
+######### <CONFIG> #########
+worker_socket = "/tmp/GcodeToPath.sock"
+######### </CONFIG> #########
+
+# Environment variables forwarded from PrusaSlicer to the worker
+_slicer_env = ("SLIC3R_PP_OUTPUT_NAME",)
+
+
+def serve() -> int:
+    """Run the worker: import GcodeToPath once, then process jobs from the socket one at a time"""
+    if (os.path.exists(worker_socket)):
+        # Only replace the socket if it is stale, not if a worker is listening on it
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            try:
+                probe.connect(worker_socket)
+            except OSError:
+                os.remove(worker_socket)
+            else:
+                print(f"A worker is already running on {worker_socket}", file=sys.stderr)
+                return 1
+    import GcodeToPath
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+        server.bind(worker_socket)
+        server.listen()
+        print(f"Listening on {worker_socket}")
+        try:
+            while True:
+                conn, _ = server.accept()
+                with conn, conn.makefile("rwb") as stream:
+                    request = stream.readline()
+                    if (not request):
+                        continue
+                    log = io.StringIO()
+                    try:
+                        job = json.loads(request)
+                        print(f"Job: {job['file']}")
+                        with redirect_stdout(log):
+                            output_name = GcodeToPath.apply_slicer_env(job["env"])
+                            GcodeToPath.process_file(job["file"], output_name)
+                        reply = {"ok": True, "log": log.getvalue()}
+                    except Exception as e:
+                        reply = {"ok": False, "log": log.getvalue(), "error": f"{type(e).__name__}: {e}"}
+                    print(reply.get("error", "Done"))
+                    stream.write(json.dumps(reply).encode() + b"\n")
+        finally:
+            os.remove(worker_socket)
+
+
+def submit(file_name: str) -> Optional[bool]:
+    """Send a job to the worker and wait for it to finish. Returns None if no worker is running"""
+    job = {"file": os.path.abspath(file_name),
+           "env": {k: os.environ[k] for k in _slicer_env if k in os.environ}}
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(worker_socket)
+    except OSError:
+        conn.close()
+        return None
+    with conn, conn.makefile("rwb") as stream:
+        stream.write(json.dumps(job).encode() + b"\n")
+        stream.flush()
+        reply = json.loads(stream.readline())
+    print(reply["log"], end="")
+    if (not reply["ok"]):
+        print(reply["error"], file=sys.stderr)
+    return reply["ok"]
+
+
+def main() -> int:
+    if (len(sys.argv) > 1 and sys.argv[1] == "--serve"):
+        return serve()
+    if (len(sys.argv) < 2):
+        print("usage: path_worker.py <gcode file> | --serve", file=sys.stderr)
+        return 2
+
+    ok = submit(sys.argv[1])
+    if (ok is None):
+        # No worker running, process it here
+        import GcodeToPath
+        return GcodeToPath.main()
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -8,6 +8,7 @@ import numpy as np
 from tkinter.filedialog import askopenfile
 from matplotlib import pyplot as plt
 import GcodeToPath
+import path_formats
 from accel_curves import acc_spline
 from LivePlotting import LivePlot2D
 
@@ -36,11 +37,11 @@ def spline_gen():
 
 def plotFromFile():
     # Select and load the CSV file
-    file_path = askopenfilename(filetypes=[("CSV files", "*.csv")],
+    file_path = askopenfilename(filetypes=[("Path files", "*.csv *.bin *.gz *.xz")],
                                 initialdir="C:/Users/westn/OneDrive - Widener University/Research/Nagel Lab/Dual Stage 3D printer/pathCSVs")
 
-    # Load the CSV file into a NumPy array
-    data = np.genfromtxt(file_path, delimiter=',', skip_header=1)
+    # Load the CSV, binary or compressed file into a NumPy array
+    data = path_formats.load_path(file_path)
 
     # Check the shape of the data to understand its structure
     print("Data shape:", data.shape)